@@ -5,7 +5,9 @@ import os
 import subprocess
 
 from .slurm import Slurm
+from .spec import JobSpec
 from .parser import add_slurm_argument, select_slurm_arguments
+from .collect import gather
 
 # Add user slurm if it is not presented in /etc/passwd
 # This hack is used for using Slurm inside a singularity container
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cluster snapshot for partition selection."""
+
+# Author: Zhifang Ye
+# Email: zhifang.ye.fghm@gmail.com
+# Notes:
+
+from __future__ import annotations
+from typing import Optional, Union
+import re
+import time
+import datetime
+import subprocess
+
+from .utils import convert_to_mb, convert_to_seconds
+
+# Fields queried from sinfo (one line per node and partition)
+SINFO_FIELDS = [
+    "PartitionName",
+    "NodeHost",
+    "StateLong",
+    "CPUsState",
+    "Memory",
+    "AllocMem",
+    "Time",
+]
+# Nodes in these states could accept new jobs. States with flags (e.g.
+# 'idle*' not responding, 'idle~' powered down, 'mixed@' reboot pending)
+# are not usable.
+USABLE_STATES = ["idle", "mixed"]
+
+_snapshot_cache = {"time": 0.0, "snapshot": None}
+
+
+class ClusterSnapshot:
+    """Idle resources of each partition from a single sinfo query.
+
+    For each partition, the snapshot records the time limit and the idle CPUs
+    and free memory (MB) of every idle or mixed node. Aggregated idle CPUs on
+    idle and mixed nodes are available as 'idle_cpus' and 'mixed_cpus'.
+    """
+
+    def __init__(self, sinfo_output: str):
+        self.created = time.time()
+        self.partitions = dict()
+        for line in sinfo_output.split("\n"):
+            fields = [i.strip() for i in line.split("|")]
+            if len(fields) < len(SINFO_FIELDS):
+                continue
+            partition, node, state, cpus, memory, alloc_mem, time_limit = fields[
+                : len(SINFO_FIELDS)
+            ]
+            # default partition is marked with '*'
+            partition = partition.rstrip("*")
+            state = state.lower()
+            info = self.partitions.setdefault(
+                partition,
+                {
+                    "time_limit": convert_to_seconds(time_limit),
+                    "idle_cpus": 0,
+                    "mixed_cpus": 0,
+                    "free_mem": 0,
+                    "nodes": dict(),
+                },
+            )
+            if state not in USABLE_STATES:
+                continue
+            # CPUsState is 'allocated/idle/other/total'
+            idle_cpus = int(cpus.split("/")[1])
+            free_mem = int(memory) - int(alloc_mem or 0)
+            info["nodes"][node] = (idle_cpus, free_mem)
+            info[f"{state}_cpus"] += idle_cpus
+            info["free_mem"] += free_mem
+
+    def __repr__(self) -> str:
+        return repr(
+            {
+                k: {i: j for i, j in v.items() if i != "nodes"}
+                for k, v in self.partitions.items()
+            }
+        )
+
+    def fit_count(self, partition: str, cpus_per_task: int, mem: float) -> int:
+        """Counts how many tasks could start now on a partition.
+
+        The mem is in MB per node.
+        """
+
+        count = 0
+        for idle_cpus, free_mem in self.partitions[partition]["nodes"].values():
+            n_cpu = idle_cpus // cpus_per_task
+            n_mem = int(free_mem // mem) if mem > 0 else n_cpu
+            count += min(n_cpu, n_mem)
+        return count
+
+    def select_partition(
+        self,
+        candidates: Optional[list[str]] = None,
+        cpus_per_task: Union[int, str] = 1,
+        mem: Union[float, str] = 0,
+        time_limit: Union[int, str] = 0,
+        nodes: Union[int, str] = 1,
+        test_only: bool = False,
+        n_test: int = 3,
+        extra_args: list[str] = [],
+    ) -> str:
+        """Selects the partition most likely to start a job soonest.
+
+        Candidates whose time limit is shorter than the requested time are
+        excluded. The rest are ranked by the number of tasks (of size
+        cpus_per_task and mem) that could start now, then by idle CPUs. If
+        test_only is True, start times of the top n_test candidates are
+        estimated by 'sbatch --test-only' and the earliest one is selected.
+        The extra_args (e.g. ['--account=abc']) are passed to the estimation.
+
+        The mem could be a SLURM memory string (e.g. '8GB') or number in MB.
+        The time_limit could be a SLURM time string or number in seconds.
+        """
+
+        candidates = list(self.partitions) if not candidates else candidates
+        mem_mb = convert_to_mb(mem) if isinstance(mem, str) else float(mem)
+        seconds = convert_to_seconds(time_limit) if isinstance(time_limit, str) else time_limit
+        cpus_per_task, nodes = int(cpus_per_task), int(nodes)
+
+        scores = dict()
+        for partition in candidates:
+            if partition not in self.partitions:
+                print(f"Partition {partition} is not found in cluster snapshot.")
+                continue
+            info = self.partitions[partition]
+            if info["time_limit"] < seconds:
+                continue
+            fit_nodes = sum(
+                1
+                for idle_cpus, free_mem in info["nodes"].values()
+                if idle_cpus >= cpus_per_task and free_mem >= mem_mb
+            )
+            scores[partition] = (
+                fit_nodes >= nodes,
+                self.fit_count(partition, cpus_per_task, mem_mb),
+                info["idle_cpus"] + info["mixed_cpus"],
+            )
+        if len(scores) == 0:
+            raise RuntimeError(
+                f"No partition in {', '.join(candidates)} satisfies the time limit {time_limit}."
+            )
+        ranked = sorted(scores, key=lambda x: scores[x], reverse=True)
+
+        if test_only and not scores[ranked[0]][0]:
+            start_time = {
+                p: estimate_start_time(
+                    p, cpus_per_task, mem_mb, time_limit, nodes, extra_args=extra_args
+                )
+                for p in ranked[:n_test]
+            }
+            start_time = {k: v for k, v in start_time.items() if v is not None}
+            if len(start_time) > 0:
+                return min(start_time, key=lambda x: start_time[x])
+
+        return ranked[0]
+
+
+def get_cluster_snapshot(ttl: float = 60, refresh: bool = False) -> ClusterSnapshot:
+    """Gets cluster snapshot from sinfo, cached for ttl seconds."""
+
+    snapshot = _snapshot_cache["snapshot"]
+    if refresh or (snapshot is None) or (time.time() - _snapshot_cache["time"] > ttl):
+        fmt = ",".join(f"{i}:256|" for i in SINFO_FIELDS)
+        proc = subprocess.run(
+            ["sinfo", "--noheader", "--Node", "--Format", fmt],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(proc.stdout)
+            raise RuntimeError("SLURM sinfo query failed.")
+        snapshot = ClusterSnapshot(proc.stdout)
+        _snapshot_cache["snapshot"] = snapshot
+        _snapshot_cache["time"] = snapshot.created
+
+    return snapshot
+
+
+def estimate_start_time(
+    partition: str,
+    cpus_per_task: int,
+    mem: float,
+    time_limit: Union[int, str],
+    nodes: int = 1,
+    extra_args: list[str] = [],
+) -> Optional[datetime.datetime]:
+    """Estimates job start time on a partition using 'sbatch --test-only'.
+
+    The mem is in MB. Other arguments of the job (e.g. account, qos) could be
+    given in extra_args. Returns None if the estimation failed.
+    """
+
+    if not isinstance(time_limit, str):
+        time_limit = str(int(time_limit // 60))
+    cmd = [
+        "sbatch",
+        "--test-only",
+        f"--partition={partition}",
+        f"--cpus-per-task={cpus_per_task}",
+        f"--time={time_limit}",
+        f"--nodes={nodes}",
+        "--wrap=true",
+    ] + extra_args
+    # --mem=0 requests all memory of a node
+    cmd += [f"--mem={int(mem)}M"] if mem > 0 else []
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    # e.g. sbatch: Job 1234 to start at 2024-01-01T10:00:00 using 2 processors ...
+    match = re.search(r"to start at (\S+)", proc.stdout)
+    if match is None:
+        return None
+
+    return datetime.datetime.fromisoformat(match.group(1))
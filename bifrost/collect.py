@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Functions for collecting outputs of array jobs."""
+
+# Author: Zhifang Ye
+# Email: zhifang.ye.fghm@gmail.com
+# Notes:
+
+from __future__ import annotations
+from typing import Any, Callable, Iterable, Iterator, Union
+import os
+import re
+import csv
+import json
+import itertools
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from .slurm import get_job_info
+
+# Output formats which could be read by gather
+VALID_SUFFIX = [".json", ".csv", ".npy"]
+# Consolidated file formats for each output format
+CONSOLIDATED_SUFFIX = {
+    ".json": [".jsonl"],
+    ".csv": [".jsonl", ".csv"],
+    ".npy": [".jsonl", ".npy"],
+}
+# Job states of tasks which are still in the queue
+UNFINISHED_STATES = [
+    "PENDING",
+    "RUNNING",
+    "REQUEUED",
+    "RESIZING",
+    "SUSPENDED",
+    "CONFIGURING",
+    "COMPLETING",
+]
+
+
+def gather(
+    job_id: Union[int, str],
+    pattern: Union[Path, str],
+    reducer: Union[Callable[[int, Any], Any], Path, str],
+    max_workers: int = 8,
+    mmap_threshold: int = 64 * 1024**2,
+) -> dict[str, list[int]]:
+    """Gathers per-task outputs of a finished array job.
+
+    The filename pattern could contain the SLURM filename patterns %A
+    (master job id), %a (array index), %j (job id of the task), %x (job
+    name) and %%.
+    Array indices are taken from the job accounting (sacct). Files are read
+    by a thread pool and the records are streamed in array index order, so
+    only a few records are kept in memory at the same time.
+
+    The reducer could be either:
+        1) A callable:
+            Called as reducer(task_id, record) for each task.
+        2) A filename:
+            All records are written into a single consolidated file. The
+            format is determined by its suffix: '.jsonl' (one record per line),
+            '.csv' (rows with an extra 'task_id' column, CSV outputs only) or
+            '.npy' (arrays stacked along a new first axis, NPY outputs only,
+            row i corresponds to the i-th completed task).
+
+    Records are parsed as: JSON -> python object, CSV -> list of dict,
+    NPY -> numpy array (memory mapped if file size >= mmap_threshold).
+
+    Returns a dict with the array indices of 'completed', 'missing' (job
+    completed but output could not be read or consolidated), 'failed' (job ended without
+    completion) and 'unfinished' (job still pending or running) tasks. The
+    indices of missing and failed tasks could be passed directly to
+    Slurm.set_array for resubmission.
+    """
+
+    pattern = Path(pattern).as_posix()
+    suffix = Path(pattern).suffix
+    if suffix not in VALID_SUFFIX:
+        raise ValueError(f"Unsupported output format. Valid suffix: {', '.join(VALID_SUFFIX)}.")
+    unknown = [i for i in re.findall(r"%\d*(.)", pattern) if i not in "Aajx%"]
+    if len(unknown) > 0:
+        raise ValueError(
+            f"Unsupported filename pattern: {', '.join('%' + i for i in unknown)}. "
+            "Valid patterns: %A, %a, %j, %x and %%."
+        )
+    if callable(reducer):
+        writer = None
+    else:
+        writer = _ConsolidatedWriter(reducer, suffix)
+
+    # Find array tasks from accounting
+    master_id = str(job_id).split("_")[0]
+    tasks = get_array_tasks(master_id)
+    if len(tasks) == 0:
+        raise RuntimeError(f"No array task found for job {master_id}.")
+    unfinished = [i for i, (_, state, _) in tasks.items() if state in UNFINISHED_STATES]
+    failed = [
+        i
+        for i, (_, state, _) in tasks.items()
+        if state != "COMPLETED" and state not in UNFINISHED_STATES
+    ]
+    files = {
+        i: expand_pattern(pattern, master_id, i, raw_id, job_name)
+        for i, (raw_id, state, job_name) in tasks.items()
+        if state == "COMPLETED"
+    }
+    missing = [i for i, f in files.items() if not os.path.isfile(f)]
+    files = {i: f for i, f in files.items() if i not in missing}
+
+    # Read files and stream records
+    completed = []
+    try:
+        if writer is not None:
+            writer.open(len(files))
+        for task_id, future in _submit_in_order(
+            lambda f: _read_output(f, mmap_threshold), files.items(), max_workers
+        ):
+            try:
+                record = future.result()
+            except (OSError, ValueError) as e:
+                print(f"Failed to read output of task {task_id}: {e}")
+                missing.append(task_id)
+                continue
+            if writer is None:
+                reducer(task_id, record)
+            else:
+                try:
+                    writer.write(task_id, record)
+                except ValueError as e:
+                    print(f"Failed to consolidate output of task {task_id}: {e}")
+                    missing.append(task_id)
+                    continue
+            completed.append(task_id)
+    except BaseException:
+        # keep the original error if cleanup fails
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+    return {
+        "completed": completed,
+        "missing": sorted(missing),
+        "failed": failed,
+        "unfinished": unfinished,
+    }
+
+
+def get_array_tasks(job_id: Union[int, str]) -> dict[int, tuple[str, str, str]]:
+    """Gets array indices, raw job ids, states and job names of an array job.
+
+    Pending tasks are reported by accounting as a range (e.g. 1234_[5-9%2]),
+    which are expanded to individual indices.
+    """
+
+    job_info = get_job_info(
+        str(job_id),
+        output_format="JobID,JobIDRaw,State,JobName",
+        no_header=True,
+        extra_args=["--parsable2"],
+    ).split("\n")
+
+    tasks = dict()
+    for line in job_info:
+        if line.count("|") < 3:
+            continue
+        # job name could contain '|'
+        task, raw_id, state, job_name = line.split("|", 3)
+        if "_" not in task:
+            continue
+        # 'CANCELLED by 1234' -> 'CANCELLED'
+        state = state.split(" ")[0]
+        index = task.split("_", 1)[1]
+        if index.startswith("["):
+            for i in _expand_index_range(index):
+                tasks[i] = (raw_id, state, job_name)
+        else:
+            tasks[int(index)] = (raw_id, state, job_name)
+
+    return dict(sorted(tasks.items()))
+
+
+def expand_pattern(
+    pattern: str,
+    master_id: Union[int, str],
+    task_id: Union[int, str],
+    raw_id: Union[int, str],
+    job_name: str = "",
+) -> str:
+    """Replaces SLURM filename patterns with values of an array task."""
+
+    # Zero-padding of %a (e.g. %3a) is supported as in sbatch
+    values = {
+        "A": str(master_id),
+        "a": str(task_id),
+        "j": str(raw_id),
+        "x": job_name,
+        "%": "%",
+    }
+
+    def replace(match: re.Match) -> str:
+        width, symbol = match.groups()
+        if symbol not in values:
+            return match.group(0)
+        return values[symbol].zfill(int(width)) if width else values[symbol]
+
+    return re.sub(r"%(\d*)([Aajx%])", replace, pattern)
+
+
+def _expand_index_range(index: str) -> list[int]:
+    """Expands array index range in sacct output (e.g. '[1-3,5%2]')."""
+
+    index = index.strip("[]").split("%")[0]
+    expanded = []
+    for part in index.split(","):
+        if "-" in part:
+            start, stop = part.split("-")
+            step = 1
+            if ":" in stop:
+                stop, step = stop.split(":")
+            expanded += list(range(int(start), int(stop) + 1, int(step)))
+        elif part != "":
+            expanded.append(int(part))
+
+    return expanded
+
+
+def _submit_in_order(
+    func: Callable, items: Iterable[tuple[int, str]], max_workers: int
+) -> Iterator[tuple[int, Future]]:
+    """Submits jobs to a thread pool and yields futures in input order.
+
+    At most 2 * max_workers jobs are in flight, which bounds the number of
+    records held in memory.
+    """
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        queue = deque(
+            (k, executor.submit(func, v)) for k, v in itertools.islice(items, 2 * max_workers)
+        )
+        while queue:
+            yield queue.popleft()
+            for k, v in itertools.islice(items, 1):
+                queue.append((k, executor.submit(func, v)))
+
+
+def _read_output(filename: str, mmap_threshold: int) -> Any:
+    """Reads a single output file based on its suffix."""
+
+    suffix = Path(filename).suffix
+    if suffix == ".json":
+        with open(filename) as f:
+            return json.load(f)
+    if suffix == ".csv":
+        with open(filename, newline="") as f:
+            return list(csv.DictReader(f))
+    if suffix == ".npy":
+        np = _import_numpy()
+        mmap_mode = "r" if os.path.getsize(filename) >= mmap_threshold else None
+        return np.load(filename, mmap_mode=mmap_mode, allow_pickle=False)
+    raise ValueError(f"Unsupported output format: {filename}")
+
+
+def _import_numpy():
+    """Imports numpy which is only required for NPY files."""
+
+    try:
+        import numpy as np
+    except ImportError as e:
+        raise ImportError("Package numpy is required for reading or writing NPY files.") from e
+
+    return np
+
+
+class _ConsolidatedWriter:
+    """Writes streamed records into a single file."""
+
+    def __init__(self, out_file: Union[Path, str], input_suffix: str):
+        self.out_file = Path(out_file)
+        self.suffix = self.out_file.suffix
+        valid_suffix = CONSOLIDATED_SUFFIX[input_suffix]
+        if self.suffix not in valid_suffix:
+            raise ValueError(
+                f"Consolidated file of {input_suffix} outputs needs to be a "
+                f"{' or '.join(repr(i) for i in valid_suffix)} file."
+            )
+        self.f = None
+        self.csv_writer = None
+        self.array = None
+        self.n_record = 0
+        self.n_written = 0
+
+    def open(self, n_record: int):
+        """Opens output file. The number of records is needed for NPY file."""
+
+        self.n_record = n_record
+        if self.suffix == ".jsonl":
+            self.f = open(self.out_file, "w")
+        elif self.suffix == ".csv":
+            self.f = open(self.out_file, "w", newline="")
+
+    def write(self, task_id: int, record: Any):
+        """Writes a single record."""
+
+        if self.suffix == ".jsonl":
+            if hasattr(record, "tolist"):
+                record = record.tolist()
+            self.f.write(json.dumps({"task_id": task_id, "record": record}) + "\n")
+        elif self.suffix == ".csv":
+            if len(record) == 0:
+                return
+            # header is determined by the first task, check before writing any row
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(
+                    self.f, fieldnames=["task_id"] + list(record[0].keys())
+                )
+                self.csv_writer.writeheader()
+            columns = set(self.csv_writer.fieldnames[1:])
+            for row in record:
+                if set(row.keys()) != columns:
+                    raise ValueError(
+                        f"Columns of task {task_id} output {list(row.keys())} don't match "
+                        f"{self.csv_writer.fieldnames[1:]}."
+                    )
+            for row in record:
+                self.csv_writer.writerow({"task_id": task_id, **row})
+        elif self.suffix == ".npy":
+            np = _import_numpy()
+            record = np.asarray(record)
+            # Output array is created on disk when the first record arrives
+            if self.array is None:
+                self.array = np.lib.format.open_memmap(
+                    self.out_file,
+                    mode="w+",
+                    dtype=record.dtype,
+                    shape=(self.n_record,) + record.shape,
+                )
+            if record.shape != self.array.shape[1:]:
+                raise ValueError(
+                    f"Shape of task {task_id} output {record.shape} doesn't match "
+                    f"{self.array.shape[1:]}."
+                )
+            self.array[self.n_written] = record
+        self.n_written += 1
+
+    def close(self):
+        """Closes output file."""
+
+        if self.f is not None:
+            self.f.close()
+        if self.array is not None:
+            self.array.flush()
+            n_row = self.array.shape[0]
+            # Remove unwritten rows of tasks failed to be read
+            if self.n_written < n_row:
+                self._shrink_array()
+            del self.array
+            self.array = None
+
+    def abort(self):
+        """Closes and removes incomplete output file after an error."""
+
+        if self.f is not None:
+            self.f.close()
+        self.array = None
+        try:
+            self.out_file.unlink()
+        except OSError:
+            pass
+
+    def _shrink_array(self):
+        """Rewrites NPY file with written rows only."""
+
+        np = _import_numpy()
+        tmp_file = self.out_file.with_name(f".{self.out_file.name}.tmp")
+        shrunk = np.lib.format.open_memmap(
+            tmp_file,
+            mode="w+",
+            dtype=self.array.dtype,
+            shape=(self.n_written,) + self.array.shape[1:],
+        )
+        # copy in chunks to avoid loading the whole array
+        for i in range(0, self.n_written, 1024):
+            shrunk[i : i + 1024] = self.array[i : min(i + 1024, self.n_written)]
+        shrunk.flush()
+        del shrunk
+        os.replace(tmp_file, self.out_file)
@@ -2,14 +2,36 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import annotations
-from typing import Union
+from typing import Optional, Union
 import os
 from pathlib import Path
 import subprocess
 import argparse
+import re
 import time
 
-from .utils import read_config_file, format_key, format_value, IGNORE_BOOLEAN
+from .utils import (
+    read_config_file,
+    format_key,
+    format_value,
+    convert_to_seconds,
+    IGNORE_BOOLEAN,
+)
+from .spec import JobSpec, slurm_argument_keys
+from .cluster import get_cluster_snapshot
+
+
+# Job arguments passed to 'sbatch --test-only' for partition selection
+PARTITION_TEST_ARGUMENTS = [
+    "account",
+    "qos",
+    "reservation",
+    "constraint",
+    "gres",
+    "gpus",
+    "nodelist",
+    "exclude",
+]
 
 
 class Slurm:
@@ -35,6 +57,8 @@ class Slurm:
         self.parser = argparse.ArgumentParser()
         for arg in arguments:
             self.parser.add_argument(*(format_key(a) for a in arg[0:2] if a != ""), help=arg[3])
+        # Populate namespace with default values (None)
+        self.parser.parse_args([], namespace=self.namespace)
 
         # Add filename patterns as static variables
         for pattern in read_config_file(__pkg_path.joinpath("config", "filename_patterns.txt")):
@@ -49,11 +73,18 @@ class Slurm:
             self._create_setter_method(arg[0])
 
         # Add provided arguments in constructor
+        candidates = kwargs.pop("candidates", None)
         self.add_arguments(*args, **kwargs)
 
         # Set default values for common arguments (if not provided)
         self._set_defaults()
 
+        # Select partition from candidates at submission
+        if self.namespace.partition == "auto":
+            self.set_auto_partition(candidates)
+        elif candidates is not None:
+            raise ValueError("Argument candidates requires partition='auto'.")
+
     def __str__(self) -> str:
         """Prints the generated sbatch script."""
         return self.format_arguments()
@@ -96,18 +127,148 @@ class Slurm:
             f"{self.array_variable}=${{ARRAY[{self.SLURM_ARRAY_TASK_ID}]}}",
         ]
 
+    def set_checkpoint(
+        self,
+        checkpoint_command: Union[str, list[str]],
+        max_segments: int,
+        warning_time: int = 10,
+        resume_option: str = "--resume",
+    ):
+        """Set automatic checkpoint-and-resubmit chaining for long job.
+
+        SLURM sends signal USR1 to the batch script warning_time minutes
+        before the time limit. The signal handler runs the checkpoint command
+        and resubmits the same script with dependency afterany on current job,
+        until max_segments segments have been submitted.
+
+        In resubmitted segments, the environment variable BIFROST_RESUME is
+        set to 1 and BIFROST_SEGMENT holds the segment number (starting from 1).
+        The attribute resume_flag expands to resume_option in resubmitted
+        segments only, so it could be used directly in the command. The process
+        id of the running command (a subshell) is available as BIFROST_PID in
+        the checkpoint command.
+
+        The signal argument is used by the checkpoint handler, so it should
+        not be set otherwise.
+        """
+
+        if max_segments < 1:
+            raise ValueError("Argument max_segments needs to be a positive integer.")
+        # signal set by previous call of set_checkpoint could be replaced
+        if (self.namespace.signal is not None) and not (
+            self.additional_checkpoint_info
+            and self.namespace.signal == self._checkpoint_signal(self.warning_time)
+        ):
+            raise ValueError(
+                f"Argument signal ({self.namespace.signal}) conflicts with checkpoint chaining."
+            )
+        self._check_checkpoint_time(warning_time)
+
+        self.additional_checkpoint_info = True
+        self.checkpoint_command = self._preprocess_command(checkpoint_command, convert=False)
+        self.max_segments = max_segments
+        self.warning_time = warning_time
+        self.resume_option = resume_option
+        self.resume_flag = f"${{BIFROST_RESUME:+{resume_option}}}"
+        self.namespace.signal = self._checkpoint_signal(warning_time)
+
+    def set_auto_partition(
+        self, candidates: Optional[list[str]] = None, test_only: bool = False, ttl: float = 60
+    ):
+        """Set automatic partition selection from candidates.
+
+        Automatic selection is enabled whenever the partition is 'auto' (e.g.
+        set_partition('auto')), and disabled by setting any other partition.
+        The partition is selected each time the job script is generated, using
+        a cached sinfo snapshot (refreshed after ttl seconds). The candidate
+        most likely to start the job soonest given cpus_per_task, mem and time
+        is selected. If no candidate is given, all partitions are considered.
+        If test_only is True, 'sbatch --test-only' is used to estimate start
+        times when no candidate could start the job immediately.
+        """
+
+        self.partition_candidates = list(candidates) if candidates else []
+        self.partition_test_only = test_only
+        self.partition_ttl = ttl
+        self.namespace.partition = "auto"
+
+    def to_spec(self, command: Union[str, list[str], None] = None) -> JobSpec:
+        """Creates an immutable, serializable JobSpec of current job."""
+
+        if command is not None:
+            command = self._preprocess_command(command, convert=False)
+        auto_partition = self.namespace.partition == "auto"
+        arguments = dict(vars(self.namespace))
+        # checkpoint signal is derived from warning_time in from_spec
+        if self.additional_checkpoint_info:
+            arguments["signal"] = None
+        return JobSpec(
+            arguments=arguments,
+            log_dir=self.log_dir,
+            custom_output=self.custom_output,
+            array_variable=self.array_variable if self.additional_array_info else None,
+            array_list=self.array_list if self.additional_array_info else None,
+            command=command,
+            checkpoint_command=(
+                self.checkpoint_command if self.additional_checkpoint_info else None
+            ),
+            max_segments=self.max_segments if self.additional_checkpoint_info else None,
+            warning_time=self.warning_time if self.additional_checkpoint_info else None,
+            resume_option=self.resume_option if self.additional_checkpoint_info else None,
+            partition_candidates=self.partition_candidates if auto_partition else None,
+            partition_test_only=self.partition_test_only if auto_partition else False,
+            partition_ttl=self.partition_ttl if auto_partition else None,
+        )
+
+    @classmethod
+    def from_spec(cls, spec: JobSpec) -> Slurm:
+        """Creates a Slurm instance from a JobSpec."""
+
+        slurm = cls()
+        for k in slurm_argument_keys():
+            setattr(slurm.namespace, k, None)
+        for k, v in spec.arguments:
+            setattr(slurm.namespace, k, v)
+        slurm.log_dir = spec.log_dir
+        slurm.custom_output = spec.custom_output
+        if spec.has_array_info:
+            slurm.set_array_info(spec.array_variable, spec.array_list.split(" "))
+        # signal generated for checkpoint chaining is set again by set_checkpoint
+        if re.fullmatch(r"B:USR1@\d+", slurm.namespace.signal or ""):
+            slurm.namespace.signal = None
+        if spec.has_checkpoint_info:
+            slurm.set_checkpoint(
+                list(spec.checkpoint_command),
+                spec.max_segments,
+                warning_time=spec.warning_time,
+                resume_option=spec.resume_option,
+            )
+        slurm._reset_auto_partition()
+        if spec.has_auto_partition:
+            slurm.set_auto_partition(
+                spec.partition_candidates,
+                test_only=spec.partition_test_only,
+                ttl=spec.partition_ttl if spec.partition_ttl is not None else 60,
+            )
+
+        return slurm
+
     def format_arguments(self, shell: str = "/bin/sh", script_mode: bool = True) -> str:
         """Formats Slrum arguments for script or commandline usage."""
+        arguments = dict(vars(self.namespace))
+        # replace 'auto' with automatically selected partition
+        if (arguments["partition"] == "auto") and (self.selected_partition is not None):
+            arguments["partition"] = self.selected_partition
         if script_mode:
             args = [
                 f"#SBATCH --{self._valid_key(k):<19} {v}"
-                for k, v in vars(self.namespace).items()
+                for k, v in arguments.items()
                 if v is not None
             ]
             args = "\n".join([f"#!{shell}", ""] + args)
         else:
             args = []
-            for k, v in vars(self.namespace).items():
+            for k, v in arguments.items():
                 if v is not None:
                     if v != "":
                         args.append(f"--{self._valid_key(k)}={v}")
@@ -123,9 +284,12 @@ class Slurm:
         """Wraps command into a script string for sbatch."""
 
         command = self._preprocess_command(command, convert=False)
+        if self.additional_checkpoint_info:
+            command = self._add_checkpoint_handler(command)
         if self.additional_array_info:
             command = self.array_command + command
         self._modify_log_filename()
+        self._select_partition()
         script = [self.format_arguments(shell=shell)] + [""] + command
         script = "\n".join(script)
 
@@ -136,12 +300,15 @@ class Slurm:
     ) -> str:
         """Wraps command into a script string for sbatch."""
 
+        if self.additional_checkpoint_info:
+            raise RuntimeError("Checkpoint chaining is only supported for sbatch script.")
         command = self._preprocess_command(command, convert=convert)
         if self.additional_array_info:
             command = self._preprocess_command(self.array_command, convert=convert) + command
         command = "; ".join(command)
         command = [f'--wrap="{command}"']
         self._modify_log_filename()
+        self._select_partition()
         script = [self.format_arguments(script_mode=False)] + command
         script = " ".join(script)
 
@@ -174,6 +341,9 @@ class Slurm:
     def srun(self, command: Union[str, list[str]]) -> int:
         """Runs commands through SLURM srun."""
 
+        if self.additional_checkpoint_info:
+            raise RuntimeError("Checkpoint chaining is only supported for sbatch script.")
+        self._select_partition()
         args = self.format_arguments(script_mode=False)
         command = self._preprocess_command(command, convert=False)
         command = "; ".join(command)
@@ -193,8 +363,11 @@ class Slurm:
         """Writes command to a sbatch ready file."""
 
         command = self._preprocess_command(command, convert=False)
+        if self.additional_checkpoint_info:
+            command = self._add_checkpoint_handler(command)
         if self.additional_array_info:
             command = self.array_command + command
+        self._select_partition()
         script = [self.format_arguments(shell=shell)] + [""] + command
         script = "\n".join(script)
         with open(out_file, "w") as f:
@@ -226,6 +399,23 @@ class Slurm:
         """Waits until the submitted job finished."""
         return wait_completion(self.job_id)
 
+    def get_chain(self, task_id: Optional[Union[int, str]] = None) -> list[str]:
+        """Gets job ids of all segments of a checkpoint chained job.
+
+        For array job, the array index (task_id) is required since each array
+        task is chained separately. Use get_array_chain for all array tasks.
+        """
+
+        if self.namespace.array is not None:
+            if task_id is None:
+                raise ValueError("Argument task_id is required for array job.")
+            return get_chain(f"{self.job_id}_{task_id}", self.log_dir)
+        return get_chain(self.job_id, self.log_dir)
+
+    def get_array_chain(self) -> dict[int, list[str]]:
+        """Gets job ids of all segments of each task of a chained array job."""
+        return get_array_chain(self.job_id, self.log_dir)
+
     def _parse_argument(self, key: str, value: str):
         """Parses the given key-value pair."""
         key, value = format_key(key), format_value(value)
@@ -272,6 +462,8 @@ class Slurm:
         else:
             self.custom_output = True
         self.additional_array_info = False
+        self.additional_checkpoint_info = False
+        self._reset_auto_partition()
 
     def _modify_log_filename(self):
         """Modify output log filename to contain array information."""
@@ -281,6 +473,122 @@ class Slurm:
                 f"{self.JOB_NAME}_{self.JOB_ARRAY_MASTER_ID}_{self.JOB_ARRAY_ID}.log"
             )
 
+    def _reset_auto_partition(self):
+        """Resets automatic partition selection settings to defaults."""
+
+        self.partition_candidates = []
+        self.partition_test_only = False
+        self.partition_ttl = 60
+        self.selected_partition = None
+
+    def _select_partition(self):
+        """Selects partition from candidates based on cluster snapshot.
+
+        Selection only happens if the partition is 'auto', so an explicitly
+        set partition is never replaced.
+        """
+
+        if self.namespace.partition != "auto":
+            self.selected_partition = None
+            return
+        snapshot = get_cluster_snapshot(ttl=self.partition_ttl)
+        self.selected_partition = snapshot.select_partition(
+            candidates=self.partition_candidates,
+            cpus_per_task=self.namespace.cpus_per_task,
+            mem=self.namespace.mem or 0,
+            time_limit=self.namespace.time,
+            nodes=str(self.namespace.nodes or 1).split("-")[0],
+            test_only=self.partition_test_only,
+            extra_args=[
+                f"--{self._valid_key(k)}={getattr(self.namespace, k)}"
+                for k in PARTITION_TEST_ARGUMENTS
+                if getattr(self.namespace, k) not in [None, ""]
+            ],
+        )
+
+    def _check_checkpoint_time(self, warning_time: int):
+        """Checks checkpoint warning time against the time limit."""
+
+        warning_seconds = int(warning_time * 60)
+        if warning_seconds >= convert_to_seconds(self.namespace.time):
+            raise ValueError(
+                f"Warning time ({warning_time} min) needs to be shorter than the time limit "
+                f"({self.namespace.time})."
+            )
+        # signal time is limited to 65535 seconds by SLURM
+        if warning_seconds > 65535:
+            raise ValueError("Warning time needs to be shorter than 65535 seconds.")
+
+    @staticmethod
+    def _checkpoint_signal(warning_time: int) -> str:
+        """Gets signal argument for checkpoint chaining."""
+        # 'B:' sends signal to the batch shell only
+        return f"B:USR1@{int(warning_time * 60)}"
+
+    def _add_checkpoint_handler(self, command: list[str]) -> list[str]:
+        """Adds signal handler for checkpoint-and-resubmit chaining.
+
+        The command is run in background so that the batch shell could handle
+        the signal while the command is running.
+        """
+
+        # time limit or signal could be changed after set_checkpoint
+        self._check_checkpoint_time(self.warning_time)
+        if self.namespace.signal != self._checkpoint_signal(self.warning_time):
+            raise ValueError(
+                f"Argument signal ({self.namespace.signal}) conflicts with checkpoint chaining."
+            )
+
+        chain_file = Path(self.log_dir).joinpath("bifrost_chain_${BIFROST_CHAIN_ID}.txt")
+        next_segment = "$((BIFROST_SEGMENT + 1))"
+        resubmit = " ".join(
+            [
+                "sbatch",
+                "--parsable",
+                "--dependency=afterany:$SLURM_JOB_ID",
+                "${SLURM_ARRAY_TASK_ID:+--array=$SLURM_ARRAY_TASK_ID}",
+                f"--export=ALL,BIFROST_RESUME=1,BIFROST_SEGMENT={next_segment},"
+                "BIFROST_CHAIN_ID=$BIFROST_CHAIN_ID",
+                '"$BIFROST_SCRIPT"',
+            ]
+        )
+        handler = [
+            "BIFROST_SCRIPT=$0",
+            "BIFROST_CHAIN_ID=${BIFROST_CHAIN_ID:-${SLURM_ARRAY_JOB_ID:+${SLURM_ARRAY_JOB_ID}_"
+            "${SLURM_ARRAY_TASK_ID}}}",
+            "BIFROST_CHAIN_ID=${BIFROST_CHAIN_ID:-$SLURM_JOB_ID}",
+            "if [ -z \"$BIFROST_SEGMENT\" ]; then",
+            "    BIFROST_SEGMENT=1",
+            f'    echo "1 $SLURM_JOB_ID" >> "{chain_file}"',
+            "fi",
+            "_bifrost_checkpoint() {",
+            '    echo "Time limit is approaching, checkpointing segment $BIFROST_SEGMENT..."',
+            *[f"    {i}" for i in self.checkpoint_command],
+            f"    if [ $BIFROST_SEGMENT -lt {self.max_segments} ]; then",
+            f"        BIFROST_NEXT_ID=$({resubmit})",
+            f'        echo "{next_segment} ${{BIFROST_NEXT_ID%%;*}}" >> "{chain_file}"',
+            f'        echo "Submitted segment {next_segment} as job ${{BIFROST_NEXT_ID%%;*}}"',
+            "    fi",
+            "}",
+            "trap _bifrost_checkpoint USR1",
+            "",
+            "(",
+            *command,
+            ") &",
+            "BIFROST_PID=$!",
+            "wait $BIFROST_PID",
+            "# wait is interrupted when the signal is trapped",
+            "while kill -0 $BIFROST_PID 2>/dev/null; do",
+            "    wait $BIFROST_PID",
+            "done",
+            "# get exit status of the finished command",
+            "wait $BIFROST_PID",
+            "BIFROST_STATUS=$?",
+            "exit $BIFROST_STATUS",
+        ]
+
+        return handler
+
     @staticmethod
     def _valid_key(key: str) -> str:
         """Long arguments (for slurm) constructed with '-' have been internally
@@ -409,6 +717,41 @@ def wait_completion(job_id: Union[int, str, list[Union[int, str]]]) -> dict[str,
     return job_status
 
 
+def get_chain(job_id: Union[int, str], log_dir: Union[Path, str]) -> list[str]:
+    """Gets job ids of all segments of a checkpoint chained job.
+
+    The job_id is the job id of the first segment (or jobid_taskid for array
+    task). Segments are recorded in the log directory of the job.
+    """
+
+    chain_file = Path(log_dir).joinpath(f"bifrost_chain_{job_id}.txt")
+    if not chain_file.is_file():
+        return [str(job_id)]
+    segments = dict()
+    with open(chain_file) as f:
+        for line in f:
+            if line.strip() != "":
+                segment, segment_id = line.split()
+                segments[int(segment)] = segment_id
+
+    return [segments[i] for i in sorted(segments)]
+
+
+def get_array_chain(job_id: Union[int, str], log_dir: Union[Path, str]) -> dict[int, list[str]]:
+    """Gets job ids of all segments of each task of a chained array job.
+
+    The job_id is the master job id of the first segment.
+    """
+
+    chains = dict()
+    for chain_file in Path(log_dir).glob(f"bifrost_chain_{job_id}_*.txt"):
+        task_id = chain_file.stem.split("_")[-1]
+        if task_id.isdigit():
+            chains[int(task_id)] = get_chain(f"{job_id}_{task_id}", log_dir)
+
+    return dict(sorted(chains.items()))
+
+
 def _any_status(job_status: dict[str, str], status: str):
     return any([i == status for i in job_status.values()])
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Immutable, serializable representation of a Slurm job."""
+
+# Author: Zhifang Ye
+# Email: zhifang.ye.fghm@gmail.com
+# Notes:
+
+from __future__ import annotations
+from typing import Iterable, Optional, Union
+from pathlib import Path
+import json
+import functools
+
+from .utils import read_config_file, format_value, IGNORE_BOOLEAN
+
+
+@functools.lru_cache(maxsize=None)
+def slurm_argument_keys() -> tuple[str, ...]:
+    """Gets names of all SLURM arguments (in the order of config file)."""
+    arguments = read_config_file(Path(__file__).parent.joinpath("config", "arguments.txt"))
+    return tuple(arg[0] for arg in arguments)
+
+
+@functools.lru_cache(maxsize=None)
+def _slurm_argument_order() -> dict[str, int]:
+    return {k: i for i, k in enumerate(slurm_argument_keys())}
+
+
+class JobSpec:
+    """Immutable specification of a Slurm job.
+
+    A JobSpec holds the SLURM argument values, log directory, array,
+    checkpoint and partition selection information and (optionally) the job
+    command of a Slurm instance. Unlike Slurm, it is hashable and could be
+    pickled or serialized to JSON, which makes it suitable for process pools
+    and on-disk caching.
+
+    Use JobSpec.replace to derive new specs from a base spec, e.g.
+        spec.replace(job_name="sub-01", command="python demo.py sub-01")
+    """
+
+    __slots__ = (
+        "arguments",
+        "log_dir",
+        "custom_output",
+        "array_variable",
+        "array_list",
+        "command",
+        "checkpoint_command",
+        "max_segments",
+        "warning_time",
+        "resume_option",
+        "partition_candidates",
+        "partition_test_only",
+        "partition_ttl",
+        "_hash",
+    )
+
+    # Fields which could be changed by replace (besides SLURM arguments)
+    FIELDS = (
+        "log_dir",
+        "custom_output",
+        "array_variable",
+        "array_list",
+        "command",
+        "checkpoint_command",
+        "max_segments",
+        "warning_time",
+        "resume_option",
+        "partition_candidates",
+        "partition_test_only",
+        "partition_ttl",
+    )
+
+    def __init__(
+        self,
+        arguments: Union[dict[str, str], Iterable[tuple[str, str]]] = (),
+        log_dir: str = ".",
+        custom_output: bool = False,
+        array_variable: Optional[str] = None,
+        array_list: Optional[Union[str, Iterable[Union[str, int, float]]]] = None,
+        command: Optional[Union[str, Iterable[str]]] = None,
+        checkpoint_command: Optional[Union[str, Iterable[str]]] = None,
+        max_segments: Optional[int] = None,
+        warning_time: Optional[int] = None,
+        resume_option: Optional[str] = None,
+        partition_candidates: Optional[Iterable[str]] = None,
+        partition_test_only: bool = False,
+        partition_ttl: Optional[float] = None,
+    ):
+        if isinstance(arguments, dict):
+            arguments = arguments.items()
+        order = _slurm_argument_order()
+        # values are formatted the same way as in Slurm.add_arguments
+        arguments = tuple((str(k), format_value(v)) for k, v in arguments if v is not None)
+        arguments = tuple((k, v) for k, v in arguments if v != IGNORE_BOOLEAN)
+        for k, _ in arguments:
+            if k not in order:
+                raise ValueError(f"Unknown SLURM argument: {k}")
+        if (array_variable is not None) and (not isinstance(array_variable, str)):
+            raise TypeError("Argument array_variable needs to be a string.")
+        # array list is stored as in Slurm.set_array_info
+        if (array_list is not None) and (not isinstance(array_list, str)):
+            array_list = " ".join(str(i) for i in array_list)
+        if isinstance(command, str):
+            command = [command]
+        if isinstance(checkpoint_command, str):
+            checkpoint_command = [checkpoint_command]
+        # Use object.__setattr__ since the instance is immutable
+        _set = functools.partial(object.__setattr__, self)
+        _set("arguments", tuple(sorted(arguments, key=lambda x: order[x[0]])))
+        _set("log_dir", str(log_dir))
+        _set("custom_output", bool(custom_output))
+        _set("array_variable", array_variable)
+        _set("array_list", array_list)
+        _set("command", tuple(command) if command is not None else None)
+        _set(
+            "checkpoint_command",
+            tuple(checkpoint_command) if checkpoint_command is not None else None,
+        )
+        _set("max_segments", max_segments)
+        _set("warning_time", warning_time)
+        _set("resume_option", resume_option)
+        _set(
+            "partition_candidates",
+            tuple(partition_candidates) if partition_candidates is not None else None,
+        )
+        _set("partition_test_only", bool(partition_test_only))
+        _set("partition_ttl", partition_ttl)
+        _set("_hash", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, JobSpec):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self._key()))
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (self.__class__, self._key())
+
+    @property
+    def has_array_info(self) -> bool:
+        """Whether additional array information is set."""
+        return self.array_variable is not None
+
+    @property
+    def has_checkpoint_info(self) -> bool:
+        """Whether checkpoint chaining is set."""
+        return self.checkpoint_command is not None
+
+    @property
+    def has_auto_partition(self) -> bool:
+        """Whether partition is selected automatically."""
+        return self.get("partition") == "auto"
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Gets the value of a SLURM argument."""
+        return dict(self.arguments).get(key, default)
+
+    def replace(self, **changes) -> JobSpec:
+        """Creates a new spec with the given changes.
+
+        Keys could be any SLURM argument (values are formatted the same way
+        as in Slurm.add_arguments, None or False removes the argument) or one
+        of the fields in JobSpec.FIELDS.
+        """
+
+        if len(changes) == 0:
+            return self
+        fields = dict(zip(("arguments",) + self.FIELDS, self._key()))
+        arguments = dict(self.arguments)
+        for k, v in changes.items():
+            if k in self.FIELDS:
+                fields[k] = v
+            elif k in _slurm_argument_order():
+                v = format_value(v) if v is not None else IGNORE_BOOLEAN
+                if v == IGNORE_BOOLEAN:
+                    arguments.pop(k, None)
+                else:
+                    arguments[k] = v
+            else:
+                raise ValueError(f"Unknown SLURM argument or JobSpec field: {k}")
+        fields["arguments"] = arguments.items()
+
+        return self.__class__(**fields)
+
+    def to_dict(self) -> dict:
+        """Converts spec to a JSON-serializable dict."""
+        return {
+            "arguments": dict(self.arguments),
+            "log_dir": self.log_dir,
+            "custom_output": self.custom_output,
+            "array_variable": self.array_variable,
+            "array_list": self.array_list,
+            "command": list(self.command) if self.command is not None else None,
+            "checkpoint_command": (
+                list(self.checkpoint_command) if self.checkpoint_command is not None else None
+            ),
+            "max_segments": self.max_segments,
+            "warning_time": self.warning_time,
+            "resume_option": self.resume_option,
+            "partition_candidates": (
+                list(self.partition_candidates) if self.partition_candidates is not None else None
+            ),
+            "partition_test_only": self.partition_test_only,
+            "partition_ttl": self.partition_ttl,
+        }
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> JobSpec:
+        """Creates spec from a dict generated by to_dict."""
+        return cls(**spec)
+
+    def to_json(self) -> str:
+        """Serializes spec to a JSON string."""
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, spec: str) -> JobSpec:
+        """Creates spec from a JSON string generated by to_json."""
+        return cls.from_dict(json.loads(spec))
+
+    def _key(self) -> tuple:
+        return (
+            self.arguments,
+            self.log_dir,
+            self.custom_output,
+            self.array_variable,
+            self.array_list,
+            self.command,
+            self.checkpoint_command,
+            self.max_segments,
+            self.warning_time,
+            self.resume_option,
+            self.partition_candidates,
+            self.partition_test_only,
+            self.partition_ttl,
+        )
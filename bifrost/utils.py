@@ -134,3 +134,49 @@ def convert_to_gb(value: str) -> str:
     units = value[len(digits) :] or "M"
 
     return int(digits) * scale[units[0]]
+
+
+def convert_to_seconds(value: str) -> float:
+    """
+    Convert SLURM time string to seconds.
+
+    Acceptable time formats include "minutes", "minutes:seconds",
+    "hours:minutes:seconds", "days-hours", "days-hours:minutes" and
+    "days-hours:minutes:seconds". "infinite" and "UNLIMITED" are converted to inf.
+    """
+
+    value = str(value).strip()
+    if value.lower() in ["infinite", "unlimited"]:
+        return math.inf
+    days = 0
+    if "-" in value:
+        days, value = value.split("-")
+        parts = [int(i) for i in value.split(":")]
+        # days-hours[:minutes[:seconds]]
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+    else:
+        parts = [int(i) for i in value.split(":")]
+        if len(parts) == 1:
+            hours, minutes, seconds = 0, parts[0], 0
+        elif len(parts) == 2:
+            hours, (minutes, seconds) = 0, parts
+        else:
+            hours, minutes, seconds = parts
+
+    return int(days) * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+def convert_to_mb(value: str) -> float:
+    """
+    Convert SLURM memory string to MB (1024-based, as used by SLURM).
+
+    Default unit is MB if no unit is given (e.g. "8G" -> 8192, "500" -> 500).
+    """
+
+    scale = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024**2}
+    value = str(value).strip()
+    digits = "".join([c for c in value if c.isdigit() or c == "."])
+    units = value[len(digits) :].upper() or "M"
+
+    return float(digits) * scale[units[0]]